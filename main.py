@@ -151,11 +151,19 @@ def run_worker(python_path: str = sys.executable):
     return proc.wait()
 
 
-def run_once(python_path: str = sys.executable):
+def run_once(python_path: str = sys.executable, resume: bool = False, sink: str | None = None,
+             output_dir: str | None = None):
     # Lanza la sincronización completa una vez usando sync_oltp_to_olap.py
     script = os.path.join(os.path.dirname(__file__), 'sync_oltp_to_olap.py')
-    LOG.info('Ejecutando sincronización única: %s %s', python_path, script)
-    return subprocess.call([python_path, script])
+    cmd = [python_path, script]
+    if resume:
+        cmd.append('--resume')
+    if sink:
+        cmd += ['--sink', sink]
+    if output_dir:
+        cmd += ['--output-dir', output_dir]
+    LOG.info('Ejecutando sincronización única: %s', ' '.join(cmd))
+    return subprocess.call(cmd)
 
 
 def build_arg_parser():
@@ -169,6 +177,10 @@ def build_arg_parser():
     worker = sub.add_parser('worker', help='Ejecutar worker que escucha notificaciones PG')
 
     once = sub.add_parser('once', help='Ejecutar una sincronización completa una vez')
+    once.add_argument('--resume', action='store_true', help='Retomar desde el último checkpoint del full sync')
+    once.add_argument('--sink', choices=['postgres', 'parquet'], default=os.getenv('SYNC_SINK'),
+                      help='Destino: OLAP Postgres (por defecto) o ficheros Parquet (env SYNC_SINK)')
+    once.add_argument('--output-dir', default=None, help='Directorio de salida del sink parquet')
 
     return p
 
@@ -193,7 +205,7 @@ def main(argv=None):
     elif args.command == 'worker':
         return run_worker()
     elif args.command == 'once':
-        return run_once()
+        return run_once(resume=args.resume, sink=args.sink, output_dir=args.output_dir)
     else:
         parser.print_help()
         return 2
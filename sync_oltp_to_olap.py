@@ -5,7 +5,18 @@ import os
 from dotenv import load_dotenv
 import traceback
 import argparse
+import atexit
+import collections
+import decimal
+import functools
+import glob
+import itertools
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
@@ -35,24 +46,51 @@ def get_pg_conn(config):
         cursor_factory=psycopg2.extras.RealDictCursor
     )
 
-# Logger: escribe DEBUG en un fichero dentro del directorio sync, no imprime en stdout
+# Logger: escribe en un fichero dentro del directorio sync, no imprime en stdout.
+# - SYNC_LOG_LEVEL: nivel del logger 'sync' (por defecto INFO; DEBUG activa el detalle por fila)
+# - SYNC_LOG_ROW_SAMPLE: con DEBUG, registra sólo 1 de cada N líneas por fila (por defecto 1000)
+# - SYNC_LOG_ASYNC: '1' (por defecto) escribe a través de una cola y un hilo listener,
+#   de modo que el bucle de sincronización nunca se bloquea en I/O de disco
 logger = logging.getLogger('sync')
-logger.setLevel(logging.DEBUG)
+logger.setLevel(getattr(logging, os.getenv('SYNC_LOG_LEVEL', 'INFO').upper(), logging.INFO))
+LOG_ROW_SAMPLE = max(1, int(os.getenv('SYNC_LOG_ROW_SAMPLE', '1000')))
+# Un contador por mensaje: cada punto de log se muestrea 1 de cada N por su cuenta
+_row_log_counters = collections.defaultdict(itertools.count)
 try:
     log_path = os.path.join(os.path.dirname(__file__), 'sync.log')
     fh = logging.FileHandler(log_path)
-    fh.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
     fh.setFormatter(formatter)
     # Evita añadir múltiples handlers si el módulo se importa varias veces
     if not logger.handlers:
-        logger.addHandler(fh)
+        if os.getenv('SYNC_LOG_ASYNC', '1') == '1':
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, fh)
+            listener.start()
+            atexit.register(listener.stop)
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        else:
+            logger.addHandler(fh)
 except Exception:
     # En caso de fallo con el file handler, no rompemos el flujo
     pass
 
+
+def _row_debug(msg, *args):
+    # Log por fila: filtrado por nivel antes de tocar los argumentos y muestreado
+    # (1 de cada LOG_ROW_SAMPLE llamadas con el mismo mensaje) para no generar una línea por registro
+    if logger.isEnabledFor(logging.DEBUG) and next(_row_log_counters[msg]) % LOG_ROW_SAMPLE == 0:
+        logger.debug(msg, *args)
+
+
+def _log_batch_summary(stage, procesados, omitidos, started):
+    # Un único registro por lote sustituye a las líneas por fila
+    elapsed = time.monotonic() - started
+    logger.info('%s: lote completado | procesados=%d omitidos=%d | %.2fs (%.0f filas/s)',
+                stage, procesados, omitidos, elapsed, procesados / elapsed if elapsed > 0 else 0.0)
+
 def upsert_dim_cliente(cur, cliente):
-    logger.debug(f"upsert_dim_cliente: id_cliente={cliente.get('id_cliente')}")
+    _row_debug('upsert_dim_cliente: id_cliente=%s', cliente.get('id_cliente'))
     cur.execute('''
         INSERT INTO dim_cliente (id_cliente, nombre, apellido, edad, email, telefono, direccion, ciudad, pais)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -67,7 +105,7 @@ def upsert_dim_cliente(cur, cliente):
     return cliente['id_cliente']
 
 def upsert_dim_categoria(cur, categoria):
-    logger.debug(f"upsert_dim_categoria: id_categoria={categoria.get('id_categoria')}")
+    _row_debug('upsert_dim_categoria: id_categoria=%s', categoria.get('id_categoria'))
     cur.execute('''
         INSERT INTO dim_categoria (id_categoria, nombre_categoria, descripcion)
         VALUES (%s, %s, %s)
@@ -79,7 +117,7 @@ def upsert_dim_categoria(cur, categoria):
     return categoria['id_categoria']
 
 def upsert_dim_producto(cur, producto):
-    logger.debug(f"upsert_dim_producto: id_producto={producto.get('id_producto')}")
+    _row_debug('upsert_dim_producto: id_producto=%s', producto.get('id_producto'))
     cur.execute('''
         INSERT INTO dim_producto (id_producto, nombre_producto, descripcion, precio, costo, id_categoria)
         VALUES (%s, %s, %s, %s, %s, %s)
@@ -92,6 +130,17 @@ def upsert_dim_producto(cur, producto):
     ))
     return producto['id_producto']
 
+def _campos_tiempo(fecha):
+    # Atributos derivados de dim_tiempo (compartidos por el sink Postgres y el Parquet)
+    return {
+        'fecha': fecha,
+        'anio': fecha.year,
+        'mes': fecha.month,
+        'dia': fecha.day,
+        'trimestre': (fecha.month - 1) // 3 + 1,
+        'semana': fecha.isocalendar()[1],
+    }
+
 def upsert_dim_tiempo(cur, fecha):
     # Normaliza fecha a tipo date (evita problemas si recibimos datetime con hora)
     if isinstance(fecha, datetime):
@@ -101,47 +150,44 @@ def upsert_dim_tiempo(cur, fecha):
         cur.execute('SELECT id_tiempo, fecha FROM dim_tiempo WHERE fecha = CAST(%s AS date);', (fecha,))
         existing = cur.fetchone()
         if existing:
-            logger.debug(f"upsert_dim_tiempo: encontrado existente id_tiempo={existing.get('id_tiempo')} fecha={existing.get('fecha')}")
+            _row_debug('upsert_dim_tiempo: encontrado existente id_tiempo=%s fecha=%s', existing.get('id_tiempo'), existing.get('fecha'))
             return existing['id_tiempo']
 
         # Si no existe, construimos campos derivados y tratamos de insertar
-        anio = fecha.year
-        mes = fecha.month
-        dia = fecha.day
-        trimestre = (fecha.month - 1) // 3 + 1
-        semana = fecha.isocalendar()[1]
-        logger.debug(f"upsert_dim_tiempo: intentando insertar fecha={fecha} anio={anio} mes={mes} dia={dia} semana={semana}")
+        campos = _campos_tiempo(fecha)
+        logger.debug('upsert_dim_tiempo: intentando insertar %s', campos)
         try:
+            # Savepoint: ante una carrera sólo se deshace este INSERT, no el resto del bloque
+            # (filas ya escritas en la misma transacción antes del siguiente commit)
+            cur.execute('SAVEPOINT upsert_dim_tiempo;')
             cur.execute('''
                 INSERT INTO dim_tiempo (fecha, anio, mes, dia, trimestre, semana)
-                VALUES (CAST(%s AS date), %s, %s, %s, %s, %s)
+                VALUES (CAST(%(fecha)s AS date), %(anio)s, %(mes)s, %(dia)s, %(trimestre)s, %(semana)s)
                 RETURNING id_tiempo, fecha;
-            ''', (fecha, anio, mes, dia, trimestre, semana))
+            ''', campos)
             row = cur.fetchone()
+            cur.execute('RELEASE SAVEPOINT upsert_dim_tiempo;')
             if row:
-                logger.debug(f"upsert_dim_tiempo: insert result id_tiempo={row.get('id_tiempo')} fecha_guardada={row.get('fecha')}")
+                logger.debug('upsert_dim_tiempo: insert result id_tiempo=%s fecha_guardada=%s', row.get('id_tiempo'), row.get('fecha'))
                 return row['id_tiempo']
         except Exception as e:
             # Manejo de carreras: si otra transacción insertó la misma fecha, capturamos y hacemos SELECT
             from psycopg2 import errors
             if isinstance(e, errors.UniqueViolation) or 'unique' in str(e).lower():
-                # rollback parcial en el cursor/conn y re-SELECT la fila
-                try:
-                    cur.connection.rollback()
-                except Exception:
-                    pass
+                # rollback parcial hasta el savepoint y re-SELECT la fila
+                cur.execute('ROLLBACK TO SAVEPOINT upsert_dim_tiempo;')
                 cur.execute('SELECT id_tiempo, fecha FROM dim_tiempo WHERE fecha = CAST(%s AS date);', (fecha,))
                 row = cur.fetchone()
                 if row:
-                    logger.debug(f"upsert_dim_tiempo: race resolved, found id_tiempo={row.get('id_tiempo')}")
+                    logger.debug('upsert_dim_tiempo: race resolved, found id_tiempo=%s', row.get('id_tiempo'))
                     return row['id_tiempo']
             # Si no es unique violation, volver a lanzar para que el caller lo maneje/loguee
-            logger.exception(f"upsert_dim_tiempo: error al insertar fecha={fecha}: {e}")
+            logger.exception('upsert_dim_tiempo: error al insertar fecha=%s: %s', fecha, e)
             raise
 
     except Exception as ex:
         # En caso de cualquier fallo, registrar y volver a lanzar para manejo arriba
-        logger.exception(f"upsert_dim_tiempo: fallo inesperado buscando/insertando fecha={fecha}: {ex}")
+        logger.exception('upsert_dim_tiempo: fallo inesperado buscando/insertando fecha=%s: %s', fecha, ex)
         raise
 
 def upsert_dim_metodo_pago(cur, metodo_pago):
@@ -160,7 +206,7 @@ def upsert_dim_metodo_pago(cur, metodo_pago):
 def upsert_dim_envio(cur, estado_envio, metodo_envio):
     # UPSERT atómico con RETURNING para obtener el ID tanto en insert como en conflicto
     # Versión estable: permite valores vacíos ('') para los campos, solo omite si ambos son None
-    logger.debug(f"upsert_dim_envio: estado_envio={estado_envio} metodo_envio={metodo_envio}")
+    _row_debug('upsert_dim_envio: estado_envio=%s metodo_envio=%s', estado_envio, metodo_envio)
     cur.execute('''
         INSERT INTO dim_envio (estado_envio, metodo_envio)
         VALUES (%s, %s)
@@ -171,29 +217,176 @@ def upsert_dim_envio(cur, estado_envio, metodo_envio):
     row = cur.fetchone()
     return row['id_envio'] if row else None
 
-def upsert_hecho_ventas(cur, hecho):
-    logger.debug(f"upsert_hecho_ventas: id_tiempo={hecho.get('id_tiempo')} id_cliente={hecho.get('id_cliente')} id_producto={hecho.get('id_producto')} cantidad={hecho.get('cantidad')}")
+HECHO_KEY_WHERE = '''
+    id_tiempo = %(id_tiempo)s AND id_cliente = %(id_cliente)s AND id_producto = %(id_producto)s
+    AND id_categoria = %(id_categoria)s AND id_metodo_pago = %(id_metodo_pago)s AND id_envio = %(id_envio)s
+'''
+
+
+def _delta_hecho(nuevo, previo):
+    # delta = valor nuevo - valor previo (previo None: la fila es nueva y cuenta como una línea más)
+    delta = {'num_lineas': 0 if previo else 1}
+    for medida in ('cantidad', 'total_venta', 'costo_envio', 'margen'):
+        delta[medida] = (nuevo[medida] or 0) - ((previo or {}).get(medida) or 0)
+    return delta
+
+
+def upsert_hecho_ventas(cur, hecho, con_delta=True):
+    # Con con_delta devuelve el delta de las medidas para mantener los agregados. La fila previa
+    # se lee con FOR UPDATE para que otra sync concurrente sobre la misma clave no calcule su
+    # delta contra el mismo valor previo (los agregados contarían dos veces). Sin agregados que
+    # mantener basta el upsert de una sola sentencia (devuelve None)
+    _row_debug('upsert_hecho_ventas: id_tiempo=%s id_cliente=%s id_producto=%s cantidad=%s',
+               hecho.get('id_tiempo'), hecho.get('id_cliente'), hecho.get('id_producto'), hecho.get('cantidad'))
+    if not con_delta:
+        cur.execute('''
+            INSERT INTO hecho_ventas (
+                id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio,
+                cantidad, total_venta, costo_envio, margen
+            ) VALUES (
+                %(id_tiempo)s, %(id_cliente)s, %(id_producto)s, %(id_categoria)s, %(id_metodo_pago)s, %(id_envio)s,
+                %(cantidad)s, %(total_venta)s, %(costo_envio)s, %(margen)s
+            )
+            ON CONFLICT (id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio)
+            DO UPDATE SET
+                cantidad = EXCLUDED.cantidad,
+                total_venta = EXCLUDED.total_venta,
+                costo_envio = EXCLUDED.costo_envio,
+                margen = EXCLUDED.margen;
+        ''', hecho)
+        return None
+    while True:
+        cur.execute('SELECT cantidad, total_venta, costo_envio, margen FROM hecho_ventas WHERE '
+                    + HECHO_KEY_WHERE + ' FOR UPDATE;', hecho)
+        previo = cur.fetchone()
+        if previo:
+            cur.execute('''
+                UPDATE hecho_ventas SET
+                    cantidad = %(cantidad)s,
+                    total_venta = %(total_venta)s,
+                    costo_envio = %(costo_envio)s,
+                    margen = %(margen)s
+                WHERE ''' + HECHO_KEY_WHERE + ';', hecho)
+            return _delta_hecho(hecho, previo)
+        cur.execute('''
+            INSERT INTO hecho_ventas (
+                id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio,
+                cantidad, total_venta, costo_envio, margen
+            ) VALUES (
+                %(id_tiempo)s, %(id_cliente)s, %(id_producto)s, %(id_categoria)s, %(id_metodo_pago)s, %(id_envio)s,
+                %(cantidad)s, %(total_venta)s, %(costo_envio)s, %(margen)s
+            )
+            ON CONFLICT (id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio)
+            DO NOTHING
+            RETURNING (xmax = 0) AS inserted;
+        ''', hecho)
+        if cur.fetchone():
+            return _delta_hecho(hecho, None)
+        # Otra transacción insertó la misma clave entre el SELECT y el INSERT (y ya confirmó, el
+        # ON CONFLICT esperó por ella): se vuelve a leer la fila, ahora visible, con FOR UPDATE
+        _row_debug('upsert_hecho_ventas: clave insertada en paralelo, reintentando %s', hecho)
+
+
+# Agregados materializados sobre hecho_ventas, mantenidos con el delta de cada lote de _load_ventas.
+# - SYNC_ROLLUPS: '1' (por defecto) crea las tablas agg_* si faltan; con '0' no se crean, pero
+#   las que ya existan se siguen manteniendo (si no, quedarían desfasadas sin aviso)
+SYNC_ROLLUPS = os.getenv('SYNC_ROLLUPS', '1') == '1'
+ROLLUP_MEASURES = ('num_lineas', 'cantidad', 'total_venta', 'costo_envio', 'margen')
+# tabla -> columnas clave
+ROLLUP_TABLES = {
+    'agg_ventas_mes_categoria': ('anio', 'mes', 'id_categoria'),
+    'agg_ventas_cliente': ('id_cliente',),
+}
+
+
+def rollup_tables_existentes(cur):
+    # Tablas agg_* presentes en OLAP: se mantienen siempre que existan, con o sin SYNC_ROLLUPS
+    cur.execute('SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NOT NULL;', (list(ROLLUP_TABLES),))
+    return {row['t'] for row in cur.fetchall()}
+
+
+def ensure_rollup_tables(cur, crear=True):
+    # Devuelve las tablas agg_* a mantener en esta ejecución (se consulta una sola vez por sync).
+    # Con crear=True crea las que falten y, sólo en ese caso, las rellena desde hecho_ventas
+    existentes = rollup_tables_existentes(cur)
+    if not crear or existentes == set(ROLLUP_TABLES):
+        return existentes
     cur.execute('''
-        INSERT INTO hecho_ventas (
-            id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio,
-            cantidad, total_venta, costo_envio, margen
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio)
-        DO UPDATE SET
-            cantidad = EXCLUDED.cantidad,
-            total_venta = EXCLUDED.total_venta,
-            costo_envio = EXCLUDED.costo_envio,
-            margen = EXCLUDED.margen;
-    ''', (
-        hecho['id_tiempo'], hecho['id_cliente'], hecho['id_producto'], hecho['id_categoria'],
-        hecho['id_metodo_pago'], hecho['id_envio'], hecho['cantidad'], hecho['total_venta'],
-        hecho['costo_envio'], hecho['margen']
-    ))
+        CREATE TABLE IF NOT EXISTS agg_ventas_mes_categoria (
+            anio integer NOT NULL,
+            mes integer NOT NULL,
+            id_categoria integer NOT NULL,
+            num_lineas bigint NOT NULL DEFAULT 0,
+            cantidad numeric NOT NULL DEFAULT 0,
+            total_venta numeric NOT NULL DEFAULT 0,
+            costo_envio numeric NOT NULL DEFAULT 0,
+            margen numeric NOT NULL DEFAULT 0,
+            PRIMARY KEY (anio, mes, id_categoria)
+        );
+        CREATE TABLE IF NOT EXISTS agg_ventas_cliente (
+            id_cliente integer PRIMARY KEY,
+            num_lineas bigint NOT NULL DEFAULT 0,
+            cantidad numeric NOT NULL DEFAULT 0,
+            total_venta numeric NOT NULL DEFAULT 0,
+            costo_envio numeric NOT NULL DEFAULT 0,
+            margen numeric NOT NULL DEFAULT 0
+        );
+    ''')
+    measures = '''count(*), COALESCE(sum(h.cantidad), 0), COALESCE(sum(h.total_venta), 0),
+                  COALESCE(sum(h.costo_envio), 0), COALESCE(sum(h.margen), 0)'''
+    if 'agg_ventas_mes_categoria' not in existentes:
+        logger.info('ensure_rollup_tables: creando y rellenando agg_ventas_mes_categoria')
+        cur.execute(f'''
+            INSERT INTO agg_ventas_mes_categoria (anio, mes, id_categoria, {', '.join(ROLLUP_MEASURES)})
+            SELECT t.anio, t.mes, h.id_categoria, {measures}
+            FROM hecho_ventas h
+            JOIN dim_tiempo t ON t.id_tiempo = h.id_tiempo
+            GROUP BY t.anio, t.mes, h.id_categoria;
+        ''')
+    if 'agg_ventas_cliente' not in existentes:
+        logger.info('ensure_rollup_tables: creando y rellenando agg_ventas_cliente')
+        cur.execute(f'''
+            INSERT INTO agg_ventas_cliente (id_cliente, {', '.join(ROLLUP_MEASURES)})
+            SELECT h.id_cliente, {measures}
+            FROM hecho_ventas h
+            GROUP BY h.id_cliente;
+        ''')
+    cur.connection.commit()
+    return set(ROLLUP_TABLES)
 
 
-def _sync_clientes(oltp_cur, olap_cur, id_cliente=None):
-    logger.info(f"_sync_clientes start id={id_cliente}")
-    if id_cliente is None:
+def _acumular_rollup(acumulado, clave, delta):
+    totales = acumulado.setdefault(clave, [0] * len(ROLLUP_MEASURES))
+    for i, medida in enumerate(ROLLUP_MEASURES):
+        totales[i] += delta[medida]
+
+
+def apply_rollup_deltas(cur, table, deltas):
+    # Suma los deltas de un lote a la tabla de agregados (un único INSERT ... ON CONFLICT por tabla)
+    keys = ROLLUP_TABLES[table]
+    rows = [clave + tuple(totales) for clave, totales in sorted(deltas.items()) if any(totales)]
+    if not rows:
+        return
+    psycopg2.extras.execute_values(cur, f'''
+        INSERT INTO {table} AS a ({', '.join(keys + ROLLUP_MEASURES)})
+        VALUES %s
+        ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+            {', '.join(f'{m} = a.{m} + EXCLUDED.{m}' for m in ROLLUP_MEASURES)};
+    ''', rows)
+    logger.info('apply_rollup_deltas: %s | %d grupos actualizados', table, len(rows))
+
+
+def _fetch_clientes(oltp_cur, id_cliente=None, keys=None):
+    if id_cliente is None and keys is not None:
+        # Bloque de clientes por clave (todas sus filas de orden en el mismo bloque)
+        oltp_cur.execute('''
+            SELECT c.*, o.ciudad_envio, o.pais_envio
+            FROM clientes c
+            LEFT JOIN orden o ON c.id_cliente = o.id_cliente
+            WHERE c.id_cliente = ANY(%s)
+            ORDER BY c.id_cliente
+        ''', (keys,))
+    elif id_cliente is None:
         oltp_cur.execute('''
             SELECT c.*, o.ciudad_envio, o.pais_envio
             FROM clientes c
@@ -206,40 +399,82 @@ def _sync_clientes(oltp_cur, olap_cur, id_cliente=None):
             LEFT JOIN orden o ON c.id_cliente = o.id_cliente
             WHERE c.id_cliente = %s
         ''', (id_cliente,))
-    clientes = oltp_cur.fetchall()
+    return oltp_cur.fetchall()
+
+
+def _load_clientes(olap_cur, clientes):
+    started = time.monotonic()
     for cliente in clientes:
-        logger.debug(f"_sync_clientes: procesando cliente id={cliente.get('id_cliente')}")
+        _row_debug('_sync_clientes: procesando cliente id=%s', cliente.get('id_cliente'))
         upsert_dim_cliente(olap_cur, cliente)
+    _log_batch_summary('_sync_clientes', len(clientes), 0, started)
 
 
-def _sync_categorias(oltp_cur, olap_cur, id_categoria=None):
-    logger.info(f"_sync_categorias start id={id_categoria}")
-    if id_categoria is None:
+def _sync_clientes(oltp_cur, olap_cur, id_cliente=None):
+    logger.info('_sync_clientes start id=%s', id_cliente)
+    _load_clientes(olap_cur, _fetch_clientes(oltp_cur, id_cliente))
+
+
+def _fetch_categorias(oltp_cur, id_categoria=None, keys=None):
+    if id_categoria is None and keys is not None:
+        oltp_cur.execute('SELECT * FROM categoria WHERE id_categoria = ANY(%s) ORDER BY id_categoria;', (keys,))
+    elif id_categoria is None:
         oltp_cur.execute('SELECT * FROM categoria;')
     else:
         oltp_cur.execute('SELECT * FROM categoria WHERE id_categoria = %s;', (id_categoria,))
-    categorias = oltp_cur.fetchall()
+    return oltp_cur.fetchall()
+
+
+def _load_categorias(olap_cur, categorias):
+    started = time.monotonic()
     for categoria in categorias:
-        logger.debug(f"_sync_categorias: procesando categoria id={categoria.get('id_categoria')}")
+        _row_debug('_sync_categorias: procesando categoria id=%s', categoria.get('id_categoria'))
         upsert_dim_categoria(olap_cur, categoria)
+    _log_batch_summary('_sync_categorias', len(categorias), 0, started)
 
 
-def _sync_productos(oltp_cur, olap_cur, id_producto=None):
-    logger.info(f"_sync_productos start id={id_producto}")
-    if id_producto is None:
+def _sync_categorias(oltp_cur, olap_cur, id_categoria=None):
+    logger.info('_sync_categorias start id=%s', id_categoria)
+    _load_categorias(olap_cur, _fetch_categorias(oltp_cur, id_categoria))
+
+
+def _fetch_productos(oltp_cur, id_producto=None, keys=None):
+    if id_producto is None and keys is not None:
+        oltp_cur.execute('SELECT * FROM productos WHERE id_producto = ANY(%s) ORDER BY id_producto;', (keys,))
+    elif id_producto is None:
         oltp_cur.execute('SELECT * FROM productos;')
     else:
         oltp_cur.execute('SELECT * FROM productos WHERE id_producto = %s;', (id_producto,))
-    productos = oltp_cur.fetchall()
+    return oltp_cur.fetchall()
+
+
+def _load_productos(olap_cur, productos):
+    started = time.monotonic()
     for producto in productos:
-        logger.debug(f"_sync_productos: procesando producto id={producto.get('id_producto')}")
+        _row_debug('_sync_productos: procesando producto id=%s', producto.get('id_producto'))
         upsert_dim_producto(olap_cur, producto)
+    _log_batch_summary('_sync_productos', len(productos), 0, started)
 
 
-def _sync_ventas(oltp_cur, olap_cur, id_venta=None, id_orden=None):
-    logger.info(f"_sync_ventas start id_venta={id_venta} id_orden={id_orden}")
+def _sync_productos(oltp_cur, olap_cur, id_producto=None):
+    logger.info('_sync_productos start id=%s', id_producto)
+    _load_productos(olap_cur, _fetch_productos(oltp_cur, id_producto))
+
+
+def _fetch_rows_by_id(oltp_cur, table, key, ids):
+    # Una sola consulta por bloque en lugar de un SELECT por venta
+    if not ids:
+        return {}
+    oltp_cur.execute(f'SELECT * FROM {table} WHERE {key} = ANY(%s);', (list(ids),))
+    return {row[key]: row for row in oltp_cur.fetchall()}
+
+
+def _fetch_ventas(oltp_cur, id_venta=None, id_orden=None, keys=None, resolve_dims=True):
+    # Extracción desde OLTP: líneas de venta + filas de categoria/cliente/producto que
+    # referencian (en `_categoria`, `_cliente`, `_producto`), para que la carga sólo toque OLAP.
+    # resolve_dims=False omite esas filas (el sink Parquet exporta las dimensiones aparte)
     base_query = '''
-        SELECT v.fecha_venta, o.id_cliente, op.id_producto, p.id_categoria, v.metodo_pago,
+        SELECT v.id_venta, v.fecha_venta, o.id_cliente, op.id_producto, p.id_categoria, v.metodo_pago,
                o.estado_envio, o.metodo_envio, op.cantidad, op.precio_unitario, p.precio, p.costo, o.costo_envio
         FROM ventas v
         JOIN orden o ON v.id_orden = o.id_orden
@@ -253,69 +488,112 @@ def _sync_ventas(oltp_cur, olap_cur, id_venta=None, id_orden=None):
     elif id_orden is not None:
         query = base_query + ' WHERE o.id_orden = %s'
         params = [id_orden]
+    elif keys is not None:
+        # Bloque de ventas por clave (todas sus líneas de orden en el mismo bloque)
+        query = base_query + ' WHERE v.id_venta = ANY(%s) ORDER BY v.id_venta'
+        params = [keys]
     else:
         query = base_query
 
     oltp_cur.execute(query, params)
     ventas = oltp_cur.fetchall()
+    if not resolve_dims:
+        return ventas
+    categorias = _fetch_rows_by_id(oltp_cur, 'categoria', 'id_categoria', {v['id_categoria'] for v in ventas})
+    clientes = _fetch_rows_by_id(oltp_cur, 'clientes', 'id_cliente', {v['id_cliente'] for v in ventas})
+    productos = _fetch_rows_by_id(oltp_cur, 'productos', 'id_producto', {v['id_producto'] for v in ventas})
     for venta in ventas:
-        logger.debug(f"_sync_ventas: procesando venta fecha={venta.get('fecha_venta')} id_producto={venta.get('id_producto')} cantidad={venta.get('cantidad')}")
-        fecha_venta = venta['fecha_venta']
-        if not isinstance(fecha_venta, datetime):
-            fecha_venta = datetime.strptime(str(fecha_venta), "%Y-%m-%d")
-        id_tiempo = upsert_dim_tiempo(olap_cur, fecha_venta)
-        id_cliente = venta['id_cliente']
-        id_producto = venta['id_producto']
-        id_categoria = venta['id_categoria']
+        venta['_categoria'] = categorias.get(venta['id_categoria'])
+        venta['_cliente'] = clientes.get(venta['id_cliente'])
+        venta['_producto'] = productos.get(venta['id_producto'])
+    return ventas
 
-        # Asegurar que las dimensiones relacionadas existan en OLAP en el orden correcto
-        try:
-            # Categoria
+
+def _upsert_dims_bloque(olap_cur, ventas):
+    # Dimensiones referenciadas por el bloque: una vez por clave distinta y en orden de FKs
+    # (categoria antes que producto), en lugar de una vez por línea de venta
+    categorias, clientes, productos = {}, {}, {}
+    for venta in ventas:
+        categorias.setdefault(venta['id_categoria'], venta['_categoria'])
+        clientes.setdefault(venta['id_cliente'], venta['_cliente'])
+        productos.setdefault(venta['id_producto'], (venta['_producto'], venta['id_categoria']))
+    try:
+        for id_categoria, categoria_row in categorias.items():
             try:
-                oltp_cur.execute('SELECT * FROM categoria WHERE id_categoria = %s;', (id_categoria,))
-                categoria_row = oltp_cur.fetchone()
                 if categoria_row:
-                    logger.debug(f"_sync_ventas: upserting categoria id={id_categoria}")
+                    _row_debug('_sync_ventas: upserting categoria id=%s', id_categoria)
                     upsert_dim_categoria(olap_cur, categoria_row)
                 else:
-                    logger.warning(f"_sync_ventas: categoria id={id_categoria} no encontrada en OLTP; creando placeholder")
+                    logger.warning('_sync_ventas: categoria id=%s no encontrada en OLTP; creando placeholder', id_categoria)
                     upsert_dim_categoria(olap_cur, {'id_categoria': id_categoria, 'nombre_categoria': None, 'descripcion': None})
             except Exception as e:
-                logger.exception(f"_sync_ventas: fallo al asegurar dim_categoria id={id_categoria}: {e}")
+                logger.exception('_sync_ventas: fallo al asegurar dim_categoria id=%s: %s', id_categoria, e)
 
-            # Cliente
+        for id_cliente, cliente_row in clientes.items():
             try:
-                oltp_cur.execute('SELECT * FROM clientes WHERE id_cliente = %s;', (id_cliente,))
-                cliente_row = oltp_cur.fetchone()
                 if cliente_row:
-                    logger.debug(f"_sync_ventas: upserting cliente id={id_cliente}")
+                    _row_debug('_sync_ventas: upserting cliente id=%s', id_cliente)
                     upsert_dim_cliente(olap_cur, cliente_row)
                 else:
-                    logger.warning(f"_sync_ventas: cliente id={id_cliente} no encontrado en OLTP; creando placeholder")
+                    logger.warning('_sync_ventas: cliente id=%s no encontrado en OLTP; creando placeholder', id_cliente)
                     upsert_dim_cliente(olap_cur, {'id_cliente': id_cliente, 'nombre': None, 'apellido': None, 'edad': None, 'email': None, 'telefono': None, 'direccion': None, 'ciudad_envio': None, 'pais_envio': None})
             except Exception as e:
-                logger.exception(f"_sync_ventas: fallo al asegurar dim_cliente id={id_cliente}: {e}")
+                logger.exception('_sync_ventas: fallo al asegurar dim_cliente id=%s: %s', id_cliente, e)
 
-            # Producto
+        for id_producto, (producto_row, id_categoria) in productos.items():
             try:
-                oltp_cur.execute('SELECT * FROM productos WHERE id_producto = %s;', (id_producto,))
-                producto_row = oltp_cur.fetchone()
                 if producto_row:
-                    logger.debug(f"_sync_ventas: upserting producto id={id_producto}")
+                    _row_debug('_sync_ventas: upserting producto id=%s', id_producto)
                     upsert_dim_producto(olap_cur, producto_row)
                 else:
-                    logger.warning(f"_sync_ventas: producto id={id_producto} no encontrado en OLTP; creando placeholder")
+                    logger.warning('_sync_ventas: producto id=%s no encontrado en OLTP; creando placeholder', id_producto)
                     upsert_dim_producto(olap_cur, {'id_producto': id_producto, 'nombre_producto': None, 'descripcion': None, 'precio': None, 'costo': None, 'id_categoria': id_categoria})
             except Exception as e:
-                logger.exception(f"_sync_ventas: fallo al asegurar dim_producto id={id_producto}: {e}")
-
-        except Exception:
-            # Capturamos cualquier error en la preparación de dimensiones y continuamos para que el flujo lo loguee
-            logger.exception("_sync_ventas: error inesperado asegurando dimensiones relacionadas")
-        id_metodo_pago = upsert_dim_metodo_pago(olap_cur, venta['metodo_pago'])
-        id_envio = upsert_dim_envio(olap_cur, venta['estado_envio'], venta['metodo_envio'])
-        total_venta = venta['cantidad'] * venta['precio_unitario']
-        margen = (venta['precio_unitario'] - venta['costo']) * venta['cantidad']
+                logger.exception('_sync_ventas: fallo al asegurar dim_producto id=%s: %s', id_producto, e)
+
+    except Exception:
+        # Capturamos cualquier error en la preparación de dimensiones y continuamos para que el flujo lo loguee
+        logger.exception("_sync_ventas: error inesperado asegurando dimensiones relacionadas")
+
+
+def _medidas_venta(venta):
+    # Transformación de una línea de venta común a los dos sinks (Postgres y Parquet):
+    # devuelve (fecha_venta como datetime, total_venta, margen)
+    fecha_venta = venta['fecha_venta']
+    if not isinstance(fecha_venta, datetime):
+        fecha_venta = datetime.strptime(str(fecha_venta), "%Y-%m-%d")
+    total_venta = venta['cantidad'] * venta['precio_unitario']
+    margen = (venta['precio_unitario'] - venta['costo']) * venta['cantidad']
+    return fecha_venta, total_venta, margen
+
+
+def _load_ventas(olap_cur, ventas, rollups=frozenset()):
+    # rollups: tablas agg_* existentes (ensure_rollup_tables), a las que se suman los deltas del bloque
+    started = time.monotonic()
+    omitidas = 0
+    delta_mes_categoria = {}
+    delta_cliente = {}
+    # Asegurar que las dimensiones relacionadas existan en OLAP antes de los hechos
+    _upsert_dims_bloque(olap_cur, ventas)
+    # Claves subrogadas ya resueltas en este bloque (misma transacción): evita repetir el upsert por línea
+    ids_tiempo, ids_metodo_pago, ids_envio = {}, {}, {}
+    for venta in ventas:
+        _row_debug('_sync_ventas: procesando venta fecha=%s id_producto=%s cantidad=%s',
+                   venta.get('fecha_venta'), venta.get('id_producto'), venta.get('cantidad'))
+        fecha_venta, total_venta, margen = _medidas_venta(venta)
+        if fecha_venta.date() not in ids_tiempo:
+            ids_tiempo[fecha_venta.date()] = upsert_dim_tiempo(olap_cur, fecha_venta)
+        id_tiempo = ids_tiempo[fecha_venta.date()]
+        id_cliente = venta['id_cliente']
+        id_producto = venta['id_producto']
+        id_categoria = venta['id_categoria']
+        if venta['metodo_pago'] not in ids_metodo_pago:
+            ids_metodo_pago[venta['metodo_pago']] = upsert_dim_metodo_pago(olap_cur, venta['metodo_pago'])
+        id_metodo_pago = ids_metodo_pago[venta['metodo_pago']]
+        envio = (venta['estado_envio'], venta['metodo_envio'])
+        if envio not in ids_envio:
+            ids_envio[envio] = upsert_dim_envio(olap_cur, *envio)
+        id_envio = ids_envio[envio]
         hecho = {
             'id_tiempo': id_tiempo,
             'id_cliente': id_cliente,
@@ -329,23 +607,434 @@ def _sync_ventas(oltp_cur, olap_cur, id_venta=None, id_orden=None):
             'margen': margen
         }
         if all([id_tiempo, id_cliente, id_producto, id_categoria, id_metodo_pago, id_envio]):
-            upsert_hecho_ventas(olap_cur, hecho)
+            delta = upsert_hecho_ventas(olap_cur, hecho, con_delta=bool(rollups))
+            if delta is not None:
+                _acumular_rollup(delta_mes_categoria, (fecha_venta.year, fecha_venta.month, id_categoria), delta)
+                _acumular_rollup(delta_cliente, (id_cliente,), delta)
         else:
-            logger.warning(f"_sync_ventas: venta omitida por falta de dimensión: {hecho}")
+            omitidas += 1
+            logger.warning('_sync_ventas: venta omitida por falta de dimensión: %s', hecho)
+    if 'agg_ventas_mes_categoria' in rollups:
+        apply_rollup_deltas(olap_cur, 'agg_ventas_mes_categoria', delta_mes_categoria)
+    if 'agg_ventas_cliente' in rollups:
+        apply_rollup_deltas(olap_cur, 'agg_ventas_cliente', delta_cliente)
+    _log_batch_summary('_sync_ventas', len(ventas) - omitidas, omitidas, started)
+
+
+def _sync_ventas(oltp_cur, olap_cur, id_venta=None, id_orden=None, rollups=frozenset()):
+    logger.info('_sync_ventas start id_venta=%s id_orden=%s', id_venta, id_orden)
+    _load_ventas(olap_cur, _fetch_ventas(oltp_cur, id_venta=id_venta, id_orden=id_orden), rollups)
+
+
+# Etapas del full sync en orden:
+# (nombre en el checkpoint, etiqueta, extracción OLTP, carga OLAP, tabla OLTP, clave)
+FULL_SYNC_STAGES = [
+    ('clientes', 'clientes', _fetch_clientes, _load_clientes, 'clientes', 'id_cliente'),
+    ('categorias', 'categorias', _fetch_categorias, _load_categorias, 'categoria', 'id_categoria'),
+    ('productos', 'productos', _fetch_productos, _load_productos, 'productos', 'id_producto'),
+    ('ventas', 'hechos de ventas', _fetch_ventas, _load_ventas, 'ventas', 'id_venta'),
+]
+
+# Tamaño de bloque del full sync (nº de claves por transacción OLAP) y fichero de checkpoint
+SYNC_CHUNK_SIZE = max(1, int(os.getenv('SYNC_CHUNK_SIZE', '5000')))
+CHECKPOINT_FILE = os.getenv('SYNC_CHECKPOINT_FILE', os.path.join(os.path.dirname(__file__), 'sync_checkpoint.json'))
+
+# Pipeline del full sync: un hilo lector extrae bloques de OLTP mientras el hilo principal
+# carga el bloque anterior en OLAP; la cola acotada limita los bloques en memoria
+SYNC_PIPELINE = os.getenv('SYNC_PIPELINE', '1') == '1'
+SYNC_PIPELINE_DEPTH = max(1, int(os.getenv('SYNC_PIPELINE_DEPTH', '2')))
+
+
+def _iter_chunks(oltp_cur, fetch_fn, table, key, after, limit):
+    # Pagina sobre las claves de la propia tabla, no sobre las filas extraídas: un bloque puede
+    # no producir filas (p. ej. ventas sin líneas de orden) sin que eso signifique el final.
+    # Produce (filas, última clave del bloque)
+    while True:
+        oltp_cur.execute(f'''
+            SELECT {key} FROM {table}
+            WHERE (%s IS NULL OR {key} > %s)
+            ORDER BY {key} LIMIT %s;
+        ''', (after, after, limit))
+        keys = [row[key] for row in oltp_cur.fetchall()]
+        if not keys:
+            return
+        after = keys[-1]
+        yield fetch_fn(oltp_cur, keys=keys), after
 
 
-def sync_all(oltp_cur, olap_cur):
-    print('Sincronizando clientes...')
-    _sync_clientes(oltp_cur, olap_cur)
-    print('Sincronizando categorias...')
-    _sync_categorias(oltp_cur, olap_cur)
-    print('Sincronizando productos...')
-    _sync_productos(oltp_cur, olap_cur)
-    print('Sincronizando hechos de ventas...')
-    _sync_ventas(oltp_cur, olap_cur)
+def _iter_chunks_pipelined(fetch_fn, table, key, after, limit):
+    # El lector usa su propia conexión OLTP (los cursores psycopg2 no se comparten entre hilos)
+    chunks = queue.Queue(maxsize=SYNC_PIPELINE_DEPTH)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _reader():
+        conn = None
+        try:
+            conn = get_pg_conn(OLTP_CONFIG)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            for chunk in _iter_chunks(conn.cursor(), fetch_fn, table, key, after, limit):
+                if stop.is_set():
+                    return
+                _put(chunk)
+            _put(None)
+        except Exception as e:
+            _put(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    reader = threading.Thread(target=_reader, name='sync-reader', daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+def _iter_sync_chunks(oltp_cur, fetch_fn, table, key, after):
+    # Bloques de SYNC_CHUNK_SIZE claves a partir de `after`, con el lector en otro hilo si SYNC_PIPELINE
+    if SYNC_PIPELINE:
+        return _iter_chunks_pipelined(fetch_fn, table, key, after, SYNC_CHUNK_SIZE)
+    return _iter_chunks(oltp_cur, fetch_fn, table, key, after, SYNC_CHUNK_SIZE)
+
+
+def _load_checkpoint():
+    try:
+        with open(CHECKPOINT_FILE, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+    except FileNotFoundError:
+        return None
+    if data.get('stage') not in [stage[0] for stage in FULL_SYNC_STAGES]:
+        logger.warning('Checkpoint con etapa desconocida, se ignora: %s', data)
+        return None
+    return data
+
+
+def _save_checkpoint(stage, last_key):
+    # Escritura atómica: un fallo a mitad no deja un checkpoint corrupto
+    tmp_path = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump({'stage': stage, 'last_key': last_key, 'updated_at': int(time.time())}, fh)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+
+def _clear_checkpoint():
+    try:
+        os.remove(CHECKPOINT_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def sync_all(oltp_cur, olap_cur, resume=False, rollups=frozenset()):
+    # Full sync por bloques: cada bloque se confirma en OLAP y se guarda el checkpoint
+    # (etapa + última clave procesada); con resume=True se retoma desde ese punto
+    olap_conn = olap_cur.connection
+    checkpoint = _load_checkpoint() if resume else None
+    if checkpoint:
+        print(f"Retomando sincronización | Etapa: {checkpoint['stage']} | Última clave: {checkpoint.get('last_key')}")
+    elif resume:
+        print('No hay checkpoint previo; se ejecuta la sincronización completa.')
+
+    for stage, label, fetch_fn, load_fn, table, key in FULL_SYNC_STAGES:
+        after = None
+        if checkpoint:
+            if stage != checkpoint['stage']:
+                continue
+            after = checkpoint.get('last_key')
+            checkpoint = None
+        print(f'Sincronizando {label}...')
+        logger.info('full sync: etapa %s desde clave %s', stage, after)
+        if load_fn is _load_ventas:
+            load_fn = functools.partial(_load_ventas, rollups=rollups)
+        chunks = _iter_sync_chunks(oltp_cur, fetch_fn, table, key, after)
+        try:
+            for rows, last_key in chunks:
+                load_fn(olap_cur, rows)
+                olap_conn.commit()
+                _save_checkpoint(stage, last_key)
+        finally:
+            chunks.close()
+    _clear_checkpoint()
+
+
+# Sink alternativo: esquema en estrella como ficheros Parquet (vía Arrow) en un directorio local.
+# - dim_*: se reescriben completas en cada ejecución (dim_*/data.parquet), en bloques
+# - hecho_ventas: particionado en hecho_ventas/anio=AAAA/mes=M/ (estilo Hive), un fichero por
+#   tramo de SYNC_PARQUET_FILE_IDS ids de venta. Cada ejecución relee desde el tramo que contiene
+#   (marca de agua - SYNC_PARQUET_LOOKBACK) y reescribe esos tramos completos; la marca de agua
+#   (último id_venta leído) queda en _sink_state.json
+# Las dimensiones con clave subrogada de OLAP (dim_metodo_pago, dim_envio) no se exportan:
+# los hechos llevan directamente metodo_pago, estado_envio y metodo_envio.
+PARQUET_DIR = os.getenv('SYNC_PARQUET_DIR', os.path.join(os.path.dirname(__file__), 'parquet'))
+PARQUET_COMPRESSION = os.getenv('SYNC_PARQUET_COMPRESSION', 'zstd')
+PARQUET_FILE_IDS = max(1, int(os.getenv('SYNC_PARQUET_FILE_IDS', '20000')))
+PARQUET_LOOKBACK = max(0, int(os.getenv('SYNC_PARQUET_LOOKBACK', '5000')))
+
+
+def _require_pyarrow():
+    # pyarrow es opcional: sólo se necesita para el sink parquet
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError('El sink parquet requiere pyarrow (pip install pyarrow)') from e
+    return pyarrow, pyarrow.parquet
+
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+
+# Escala de los importes en Parquet (decimal(38, 10)). pyarrow no redondea: un Decimal con más
+# decimales o un float abortarían la exportación, así que se cuantizan antes con redondeo explícito
+PARQUET_MONEY_SCALE = 10
+_PARQUET_MONEY_EXP = decimal.Decimal(1).scaleb(-PARQUET_MONEY_SCALE)
+_PARQUET_MONEY_CTX = decimal.Context(prec=38, rounding=decimal.ROUND_HALF_UP, traps=[decimal.InvalidOperation])
+
+
+def _to_money(value):
+    if value is None:
+        return None
+    if not isinstance(value, decimal.Decimal):
+        # str() evita arrastrar el error binario de un float (0.1 -> 0.1000000000000000055...)
+        value = decimal.Decimal(str(value))
+    return value.quantize(_PARQUET_MONEY_EXP, context=_PARQUET_MONEY_CTX)
+
+
+def _parquet_schemas(pa):
+    # Importes como decimal (psycopg2 entrega numeric como Decimal), cuantizados con _to_money
+    money = pa.decimal128(38, PARQUET_MONEY_SCALE)
+    return {
+        'dim_cliente': pa.schema([
+            ('id_cliente', pa.int64()), ('nombre', pa.string()), ('apellido', pa.string()),
+            ('edad', pa.int64()), ('email', pa.string()), ('telefono', pa.string()),
+            ('direccion', pa.string()), ('ciudad', pa.string()), ('pais', pa.string()),
+        ]),
+        'dim_categoria': pa.schema([
+            ('id_categoria', pa.int64()), ('nombre_categoria', pa.string()), ('descripcion', pa.string()),
+        ]),
+        'dim_producto': pa.schema([
+            ('id_producto', pa.int64()), ('nombre_producto', pa.string()), ('descripcion', pa.string()),
+            ('precio', money), ('costo', money), ('id_categoria', pa.int64()),
+        ]),
+        'dim_tiempo': pa.schema([
+            ('fecha', pa.date32()), ('anio', pa.int32()), ('mes', pa.int32()), ('dia', pa.int32()),
+            ('trimestre', pa.int32()), ('semana', pa.int32()),
+        ]),
+        # anio/mes no van en el fichero: salen de la ruta de la partición
+        'hecho_ventas': pa.schema([
+            ('id_venta', pa.int64()), ('fecha', pa.date32()), ('id_cliente', pa.int64()),
+            ('id_producto', pa.int64()), ('id_categoria', pa.int64()), ('metodo_pago', pa.string()),
+            ('estado_envio', pa.string()), ('metodo_envio', pa.string()), ('cantidad', pa.int64()),
+            ('total_venta', money), ('costo_envio', money), ('margen', money),
+        ]),
+    }
+
+
+def _parquet_cliente(cliente):
+    return {
+        'id_cliente': cliente['id_cliente'], 'nombre': cliente['nombre'], 'apellido': cliente['apellido'],
+        'edad': _to_int(cliente['edad']), 'email': cliente['email'], 'telefono': cliente['telefono'],
+        'direccion': cliente['direccion'], 'ciudad': cliente.get('ciudad_envio'), 'pais': cliente.get('pais_envio'),
+    }
+
+
+def _parquet_categoria(categoria):
+    return {
+        'id_categoria': categoria['id_categoria'], 'nombre_categoria': categoria['nombre_categoria'],
+        'descripcion': categoria['descripcion'],
+    }
+
+
+def _parquet_producto(producto):
+    return {
+        'id_producto': producto['id_producto'], 'nombre_producto': producto['nombre_producto'],
+        'descripcion': producto['descripcion'], 'precio': _to_money(producto['precio']),
+        'costo': _to_money(producto['costo']), 'id_categoria': producto['id_categoria'],
+    }
+
+
+# (fichero, extracción OLTP, tabla OLTP, clave, transformación) de las dimensiones exportadas en bloques
+PARQUET_DIMS = [
+    ('dim_cliente', _fetch_clientes, 'clientes', 'id_cliente', _parquet_cliente),
+    ('dim_categoria', _fetch_categorias, 'categoria', 'id_categoria', _parquet_categoria),
+    ('dim_producto', _fetch_productos, 'productos', 'id_producto', _parquet_producto),
+]
+
+
+def _load_sink_state(output_dir):
+    try:
+        with open(os.path.join(output_dir, '_sink_state.json'), 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_sink_state(output_dir, state):
+    path = os.path.join(output_dir, '_sink_state.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(state, fh)
+    os.replace(path + '.tmp', path)
+
+
+def _tmp_path(path):
+    # Temporal con prefijo '.': pyarrow.dataset ignora esos ficheros si un fallo lo deja a medias
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+
+
+def _write_parquet_dim(pa, pq, oltp_cur, output_dir, name, fetch_fn, table, key, transform, schema):
+    # Se escribe a un .tmp y se renombra al final: los lectores nunca ven una dimensión a medias
+    dim_dir = os.path.join(output_dir, name)
+    os.makedirs(dim_dir, exist_ok=True)
+    path = os.path.join(dim_dir, 'data.parquet')
+    with pq.ParquetWriter(_tmp_path(path), schema, compression=PARQUET_COMPRESSION) as writer:
+        chunks = _iter_sync_chunks(oltp_cur, fetch_fn, table, key, None)
+        try:
+            for rows, _ in chunks:
+                started = time.monotonic()
+                # clientes llega con una fila por orden: nos quedamos con una por clave
+                registros = list({row[key]: transform(row) for row in rows}.values())
+                writer.write_table(pa.Table.from_pylist(registros, schema=schema))
+                _log_batch_summary(f'parquet {name}', len(registros), 0, started)
+        finally:
+            chunks.close()
+    os.replace(_tmp_path(path), path)
+
+
+def _write_parquet_tiempo(pa, pq, oltp_cur, output_dir, schema):
+    oltp_cur.execute('SELECT DISTINCT CAST(fecha_venta AS date) AS fecha FROM ventas ORDER BY 1;')
+    registros = [_campos_tiempo(row['fecha']) for row in oltp_cur.fetchall()]
+    dim_dir = os.path.join(output_dir, 'dim_tiempo')
+    os.makedirs(dim_dir, exist_ok=True)
+    path = os.path.join(dim_dir, 'data.parquet')
+    pq.write_table(pa.Table.from_pylist(registros, schema=schema), _tmp_path(path), compression=PARQUET_COMPRESSION)
+    os.replace(_tmp_path(path), path)
+
+
+def _tramo_hechos(id_venta):
+    # Primer id_venta del tramo (fichero) al que pertenece la venta
+    return id_venta // PARQUET_FILE_IDS * PARQUET_FILE_IDS
+
+
+def _write_parquet_tramo(pa, pq, output_dir, schema, tramo, particiones):
+    # Reescribe el tramo completo: mismo nombre de fichero en cada partición, así repetir la
+    # exportación (relectura o reintento tras un fallo) sobrescribe en lugar de duplicar
+    nombre = f"part-{tramo:012d}.parquet"
+    escritos = set()
+    for (anio, mes), registros in sorted(particiones.items()):
+        part_dir = os.path.join(output_dir, 'hecho_ventas', f'anio={anio}', f'mes={mes}')
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, nombre)
+        pq.write_table(pa.Table.from_pylist(registros, schema=schema),
+                       _tmp_path(path), compression=PARQUET_COMPRESSION)
+        os.replace(_tmp_path(path), path)
+        escritos.add(path)
+    # Ficheros del tramo en particiones que ya no tienen filas (p. ej. cambió la fecha de la venta)
+    for path in glob.glob(os.path.join(output_dir, 'hecho_ventas', 'anio=*', 'mes=*', nombre)):
+        if path not in escritos:
+            os.remove(path)
+
+
+def _write_parquet_hechos(pa, pq, oltp_cur, output_dir, schema):
+    # La marca de agua no basta por sí sola: una venta puede no tener aún líneas de orden cuando se
+    # lee, o confirmarse con un id menor que otra ya exportada. Por eso se relee una ventana de
+    # PARQUET_LOOKBACK ids hacia atrás (redondeada al inicio de su tramo) y se reescriben esos tramos
+    state = _load_sink_state(output_dir)
+    marca = state.get('hecho_ventas', {}).get('last_id_venta')
+    after = None if marca is None else _tramo_hechos(max(marca - PARQUET_LOOKBACK, 0)) - 1
+    logger.info('parquet hecho_ventas: marca de agua %s, exportando ventas con id_venta > %s', marca, after)
+    fetch_fn = functools.partial(_fetch_ventas, resolve_dims=False)
+    chunks = _iter_sync_chunks(oltp_cur, fetch_fn, 'ventas', 'id_venta', after)
+    # tramo -> {(anio, mes): registros}; un tramo se escribe cuando se han leído todas sus claves
+    pendientes = {}
+    last_key = None
+    try:
+        for ventas, last_key in chunks:
+            started = time.monotonic()
+            for venta in ventas:
+                fecha_venta, total_venta, margen = _medidas_venta(venta)
+                tramo = pendientes.setdefault(_tramo_hechos(venta['id_venta']), {})
+                tramo.setdefault((fecha_venta.year, fecha_venta.month), []).append({
+                    'id_venta': venta['id_venta'],
+                    'fecha': fecha_venta.date(),
+                    'id_cliente': venta['id_cliente'],
+                    'id_producto': venta['id_producto'],
+                    'id_categoria': venta['id_categoria'],
+                    'metodo_pago': venta['metodo_pago'],
+                    'estado_envio': venta['estado_envio'],
+                    'metodo_envio': venta['metodo_envio'],
+                    'cantidad': _to_int(venta['cantidad']),
+                    'total_venta': _to_money(total_venta),
+                    'costo_envio': _to_money(venta['costo_envio']),
+                    'margen': _to_money(margen),
+                })
+            for tramo in sorted(t for t in pendientes if t + PARQUET_FILE_IDS - 1 <= last_key):
+                _write_parquet_tramo(pa, pq, output_dir, schema, tramo, pendientes.pop(tramo))
+            # Sólo se avanza la marca de agua cuando no queda ningún tramo leído sin escribir
+            if not pendientes:
+                state['hecho_ventas'] = {'last_id_venta': last_key, 'updated_at': int(time.time())}
+                _save_sink_state(output_dir, state)
+            _log_batch_summary('parquet hecho_ventas', len(ventas), 0, started)
+    finally:
+        chunks.close()
+    # El último tramo queda incompleto: se escribe con lo leído y se relee en la siguiente ejecución
+    for tramo in sorted(pendientes):
+        _write_parquet_tramo(pa, pq, output_dir, schema, tramo, pendientes[tramo])
+    if last_key is not None:
+        state['hecho_ventas'] = {'last_id_venta': last_key, 'updated_at': int(time.time())}
+        _save_sink_state(output_dir, state)
+
+
+def export_parquet(oltp_cur, output_dir=None):
+    pa, pq = _require_pyarrow()
+    output_dir = output_dir or PARQUET_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    schemas = _parquet_schemas(pa)
+    for name, fetch_fn, table, key, transform in PARQUET_DIMS:
+        print(f'Exportando {name}...')
+        _write_parquet_dim(pa, pq, oltp_cur, output_dir, name, fetch_fn, table, key, transform, schemas[name])
+    print('Exportando dim_tiempo...')
+    _write_parquet_tiempo(pa, pq, oltp_cur, output_dir, schemas['dim_tiempo'])
+    print('Exportando hechos de ventas...')
+    _write_parquet_hechos(pa, pq, oltp_cur, output_dir, schemas['hecho_ventas'])
+
+
+def sync_oltp_to_parquet(output_dir: str | None = None):
+    oltp_conn = get_pg_conn(OLTP_CONFIG)
+    try:
+        oltp_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        export_parquet(oltp_conn.cursor(), output_dir)
+        print(f"Exportación OLTP → Parquet completada con éxito en {output_dir or PARQUET_DIR}.")
+    except Exception as e:
+        print(f"Error en la exportación a Parquet: {e}")
+        traceback.print_exc()
+    finally:
+        oltp_conn.close()
 
 
-def sync_oltp_to_olap(table: str | None = None, operation: str | None = None, record_id: int | None = None):
+def sync_oltp_to_olap(table: str | None = None, operation: str | None = None, record_id: int | None = None,
+                      resume: bool = False, sink: str = 'postgres', output_dir: str | None = None):
+    if sink == 'parquet':
+        # El sink parquet no tiene modo por registro: cada ejecución reescribe las dimensiones,
+        # así que no debe dispararse por cada notificación del worker
+        if table is not None:
+            raise ValueError('El sink parquet sólo admite la exportación completa (sin --table)')
+        return sync_oltp_to_parquet(output_dir)
     oltp_conn = get_pg_conn(OLTP_CONFIG)
     olap_conn = get_pg_conn(OLAP_CONFIG)
     try:
@@ -354,16 +1043,10 @@ def sync_oltp_to_olap(table: str | None = None, operation: str | None = None, re
         
         # Usar autocommit en OLTP para evitar transacciones abortadas
         oltp_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        rollups = ensure_rollup_tables(olap_cur, crear=SYNC_ROLLUPS)
         if table is None:
-            # Modo completo
-            print('Sincronizando clientes...')
-            _sync_clientes(oltp_cur, olap_cur)
-            print('Sincronizando categorias...')
-            _sync_categorias(oltp_cur, olap_cur)
-            print('Sincronizando productos...')
-            _sync_productos(oltp_cur, olap_cur)
-            print('Sincronizando hechos de ventas...')
-            _sync_ventas(oltp_cur, olap_cur)
+            # Modo completo (por bloques con checkpoint)
+            sync_all(oltp_cur, olap_cur, resume=resume, rollups=rollups)
         else:
             # Modo incremental por tabla/registro
             table = table.lower()
@@ -375,10 +1058,10 @@ def sync_oltp_to_olap(table: str | None = None, operation: str | None = None, re
             elif table == 'productos':
                 _sync_productos(oltp_cur, olap_cur, record_id)
             elif table == 'ventas':
-                _sync_ventas(oltp_cur, olap_cur, id_venta=record_id)
+                _sync_ventas(oltp_cur, olap_cur, id_venta=record_id, rollups=rollups)
             elif table == 'orden':
                 # Reprocesa hechos por id_orden
-                _sync_ventas(oltp_cur, olap_cur, id_orden=record_id)
+                _sync_ventas(oltp_cur, olap_cur, id_orden=record_id, rollups=rollups)
                 # Actualiza dimensión cliente relacionada (por si cambió dir. envío)
                 oltp_cur.execute('SELECT id_cliente FROM orden WHERE id_orden = %s;', (record_id,))
                 row = oltp_cur.fetchone()
@@ -398,16 +1081,18 @@ def sync_oltp_to_olap(table: str | None = None, operation: str | None = None, re
                         olap_conn.rollback()  # Reset de transacción
                         continue
                 if row:
-                    _sync_ventas(oltp_cur, olap_cur, id_orden=row['id_orden'])
+                    _sync_ventas(oltp_cur, olap_cur, id_orden=row['id_orden'], rollups=rollups)
             else:
                 # Si no reconocemos la tabla, hacemos full sync por seguridad
-                sync_all(oltp_cur, olap_cur)
+                sync_all(oltp_cur, olap_cur, rollups=rollups)
 
         olap_conn.commit()
         print("Sincronización OLTP → OLAP completada con éxito.")
     except Exception as e:
         olap_conn.rollback()
         print(f"Error en la sincronización: {e}")
+        if table is None and os.path.exists(CHECKPOINT_FILE):
+            print("Los bloques ya confirmados se conservan; relanzar con --resume para continuar.")
         traceback.print_exc() 
     finally:
         oltp_conn.close()
@@ -418,6 +1103,13 @@ if __name__ == "__main__":
     parser.add_argument('--table', type=str, default=None, help='Tabla afectada (clientes, categoria, productos, orden, orden_producto, ventas)')
     parser.add_argument('--op', type=str, default=None, help='Operación (insert, update, delete)')
     parser.add_argument('--id', type=int, default=None, help='ID del registro afectado')
+    parser.add_argument('--resume', action='store_true', help='Retomar un full sync desde el último checkpoint')
+    parser.add_argument('--sink', choices=['postgres', 'parquet'], default='postgres',
+                        help='Destino: OLAP Postgres (por defecto) o ficheros Parquet (sólo sin --table)')
+    parser.add_argument('--output-dir', type=str, default=None, help='Directorio de salida del sink parquet')
     args = parser.parse_args()
+    if args.sink == 'parquet' and args.table is not None:
+        parser.error('--sink parquet no admite --table: el sink parquet sólo hace la exportación completa')
 
-    sync_oltp_to_olap(table=args.table, operation=args.op, record_id=args.id)
\ No newline at end of file
+    sync_oltp_to_olap(table=args.table, operation=args.op, record_id=args.id, resume=args.resume,
+                      sink=args.sink, output_dir=args.output_dir)
\ No newline at end of file